@@ -0,0 +1,123 @@
+"""
+JSON Extract - Serbest metin içindeki ilk geçerli JSON değerini bulur
+
+Agent'lar ve Sandbox bazen JSON'u açıklama metniyle birlikte döner. Metin tek
+geçişte taranır: en dış seviyedeki her açılış json.JSONDecoder.raw_decode ile
+parse edilir; geçersizse parantez dengesi ve string'ler takip edilerek bloğun
+sonuna atlanır. Denenen bloklar birbiriyle örtüşmediği için süre metin
+uzunluğuyla doğrusaldır ve metin hiçbir zaman kopyalanmaz.
+
+product-agent/product_analysis_agent.py tek dosya olarak deploy edildiği için
+aynı tarayıcının bir kopyasını içerir; değişiklikler iki yerde yapılmalıdır.
+"""
+
+import json
+import re
+from typing import Any, Optional
+
+# Taranacak en büyük metin (karakter)
+MAX_EXTRACT_CHARS = 32 * 1024 * 1024
+
+_decoder = json.JSONDecoder()
+_PAIRS = {"}": "{", "]": "["}
+
+# Parantez dışında sadece açılışlar aranır (düz metindeki tırnaklar yok sayılır),
+# parantez içinde string'ler tek token olarak atlanır
+_OPENERS = {
+    True: re.compile(r"[{\[]"),
+    False: re.compile(r"\{"),
+}
+_TOKENS = {
+    True: re.compile(r'"(?:[^"\\]|\\.)*"|[{}\[\]]', re.DOTALL),
+    False: re.compile(r'"(?:[^"\\]|\\.)*"|[{}]', re.DOTALL),
+}
+
+
+def extract_json(text: str, allow_array: bool = True, max_chars: int = MAX_EXTRACT_CHARS,
+                 prefer_object: bool = False) -> Optional[Any]:
+    """
+    Metindeki ilk geçerli en dış seviye JSON object'ini (veya array'ini) döner.
+
+    Args:
+        text: JSON içeren serbest metin
+        allow_array: False ise sadece object aranır; array parantezleri yok sayılır
+        max_chars: Taranacak en büyük metin uzunluğu
+        prefer_object: True ise en dış seviyedeki bir object kendisinden önce
+                       gelen array'lere tercih edilir; array sadece metinde
+                       object yoksa döner (array elemanları en dış seviye sayılmaz)
+
+    Returns:
+        Parse edilmiş değer, bulunamazsa None
+
+    Raises:
+        ValueError: Metin max_chars'tan uzunsa
+    """
+    if len(text) > max_chars:
+        raise ValueError(f"Text too large for JSON extraction: {len(text)} > {max_chars} characters")
+
+    opener_re = _OPENERS[allow_array]
+    token_re = _TOKENS[allow_array]
+
+    # Açık parantez pozisyonları ve kapanmamış bir bloğun içinde kalan dengeli bloklar
+    stack = []
+    nested = []
+    # prefer_object ile bulunan ilk array (metinde object yoksa döner)
+    first_array = None
+    pos = 0
+    while True:
+        if not stack:
+            match = opener_re.search(text, pos)
+            if match is None:
+                break
+            # En dış seviyedeki açılış doğrudan parse edilir; geçersizse bloğun
+            # sonu token token taranarak atlanır
+            decoded = _decode(text, match.start())
+            if decoded is not None:
+                value, end = decoded
+                if not (prefer_object and isinstance(value, list)):
+                    return value
+                # Object aramaya array'in sonundan devam edilir
+                if first_array is None:
+                    first_array = value
+                pos = end
+                continue
+            stack.append(match.start())
+            pos = match.end()
+            continue
+
+        match = token_re.search(text, pos)
+        if match is None:
+            break
+        token = match.group()
+        pos = match.end()
+        if token[0] == '"':
+            continue
+        if token in "{[":
+            stack.append(match.start())
+        elif text[stack[-1]] == _PAIRS[token]:
+            start = stack.pop()
+            if stack:
+                nested.append((start, stack[-1]))
+        # Eşleşmeyen kapanışlar geçerli bir JSON bloğunun parçası olamaz; atlanır
+
+    # Metin sonunda kapanmamış açılışlar (ör. düz metindeki tek bir "{") varsa,
+    # doğrudan bunların içinde kalan bloklar da en dış seviye sayılır
+    unclosed = set(stack)
+    for start, enclosing in nested:
+        if enclosing in unclosed:
+            decoded = _decode(text, start)
+            if decoded is not None:
+                value = decoded[0]
+                if not (prefer_object and isinstance(value, list)):
+                    return value
+                if first_array is None:
+                    first_array = value
+    return first_array
+
+
+def _decode(text: str, start: int) -> Optional[tuple]:
+    """start'taki bloğu parse eder: (değer, bitiş pozisyonu); geçersizse (veya aşırı derinse) None."""
+    try:
+        return _decoder.raw_decode(text, start)
+    except (json.JSONDecodeError, RecursionError):
+        return None
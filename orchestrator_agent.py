@@ -36,6 +36,8 @@ from strands import Agent, tool
 from strands.models.bedrock import BedrockModel
 from bedrock_agentcore.runtime import BedrockAgentCoreApp
 
+from json_extract import extract_json
+
 logging.basicConfig(
     level=logging.INFO,
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
@@ -117,22 +119,16 @@ def invoke_agentcore_runtime(agent_arn: str, payload: dict, session_id: str | No
     try:
         return json.loads(text)
     except json.JSONDecodeError:
-        # JSON bloğu bulmaya çalış (agent bazen text + JSON döner)
-        json_start = text.find("{")
-        json_end = text.rfind("}") + 1
-        if json_start >= 0 and json_end > json_start:
-            try:
-                return json.loads(text[json_start:json_end])
-            except json.JSONDecodeError:
-                pass
+        # JSON bloğu bulmaya çalış (agent bazen text + JSON döner); object, array'e tercih edilir
+        try:
+            extracted = extract_json(text, prefer_object=True)
+        except ValueError:
+            extracted = None
+        if isinstance(extracted, dict):
+            return extracted
         # Array olabilir
-        json_start = text.find("[")
-        json_end = text.rfind("]") + 1
-        if json_start >= 0 and json_end > json_start:
-            try:
-                return {"data": json.loads(text[json_start:json_end])}
-            except json.JSONDecodeError:
-                pass
+        if isinstance(extracted, list):
+            return {"data": extracted}
         logger.warning("Agent response JSON olarak parse edilemedi, raw text dönülüyor")
         return {"raw_response": text}
 
@@ -370,12 +366,11 @@ def _orchestrate_with_llm(
     # Agent çıktısını parse et
     result_text = str(result)
     try:
-        json_start = result_text.find("{")
-        json_end = result_text.rfind("}") + 1
-        if json_start >= 0 and json_end > json_start:
-            return json.loads(result_text[json_start:json_end])
-    except json.JSONDecodeError:
-        pass
+        parsed = extract_json(result_text, allow_array=False)
+    except ValueError:
+        parsed = None
+    if parsed is not None:
+        return parsed
 
     return {"raw_response": result_text}
 
@@ -482,10 +477,14 @@ def invoke(payload: Dict[str, Any]) -> Dict[str, Any]:
             if isinstance(prompt_value, str):
                 try:
                     parsed = json.loads(prompt_value)
-                    if isinstance(parsed, dict) and ("customerData" in parsed or "productData" in parsed):
-                        payload = parsed
                 except (json.JSONDecodeError, ValueError):
-                    pass
+                    # Metin içine gömülü JSON olabilir
+                    try:
+                        parsed = extract_json(prompt_value, allow_array=False)
+                    except ValueError:
+                        parsed = None
+                if isinstance(parsed, dict) and ("customerData" in parsed or "productData" in parsed):
+                    payload = parsed
 
         prompt = payload.get("prompt", "Kişiselleştirilmiş kampanya önerileri oluştur")
         customer_data = payload.get("customerData")
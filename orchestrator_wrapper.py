@@ -8,6 +8,8 @@ import os
 import boto3
 from typing import Any, Dict, Optional
 
+from json_extract import extract_json
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -71,22 +73,16 @@ def invoke_agentcore_runtime(agent_arn: str, payload: dict, session_id: Optional
     try:
         return json.loads(text)
     except json.JSONDecodeError:
-        # JSON bloğu bulmaya çalış
-        json_start = text.find("{")
-        json_end = text.rfind("}") + 1
-        if json_start >= 0 and json_end > json_start:
-            try:
-                return json.loads(text[json_start:json_end])
-            except json.JSONDecodeError:
-                pass
+        # JSON bloğu bulmaya çalış; object, array'e tercih edilir
+        try:
+            extracted = extract_json(text, prefer_object=True)
+        except ValueError:
+            extracted = None
+        if isinstance(extracted, dict):
+            return extracted
         # Array olabilir
-        json_start = text.find("[")
-        json_end = text.rfind("]") + 1
-        if json_start >= 0 and json_end > json_start:
-            try:
-                return {"data": json.loads(text[json_start:json_end])}
-            except json.JSONDecodeError:
-                pass
+        if isinstance(extracted, list):
+            return {"data": extracted}
         logger.warning("Agent response JSON olarak parse edilemedi, raw text dönülüyor")
         return {"raw_response": text}
 
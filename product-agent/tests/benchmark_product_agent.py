@@ -0,0 +1,491 @@
+"""
+Product analysis benchmark suite
+
+Runs every analyzer and the whole AgentOrchestrator pipeline (per engine)
+on seeded synthetic catalogs (see catalog_generator.py) and reports p50/p99
+latency, throughput (products/s) and peak RSS as JSON. Each catalog size
+runs in a fresh process so its peak RSS is not inflated by earlier sizes.
+
+Before timing, a parity check runs every engine and catalog source (inline
+JSON, orderHistoryPath NDJSON, Parquet when pyarrow is installed, catalog
+snapshot, local sales store, sharded) on test_input_valid.json and on a
+generated catalog, and compares each result with test_output_expected.json
+or the inline python engine result. Any difference fails the run.
+
+Each engine's pipeline p50 is divided by the python engine's p50 of the
+same run and size; the run fails when a ratio exceeds --max-ratio (1.0 by
+default: no engine may be slower than the reference pipeline). Both sides
+of a ratio are timed on the same machine in the same run, so the gate does
+not depend on the host and needs no stored baseline. Sizes whose python p50 is below --min-ms are
+reported but not gated.
+
+Absolute p50s can additionally be compared against a report from an
+earlier run on the same machine (--baseline); such reports are machine
+specific and are not kept in the repository.
+
+Usage:
+    python tests/benchmark_product_agent.py                      # 1k, 10k, engine ratios gated
+    python tests/benchmark_product_agent.py --sizes 1k,10k,100k,1m --output report.json
+    python tests/benchmark_product_agent.py --update-baseline --baseline /tmp/baseline.json
+    python tests/benchmark_product_agent.py --baseline /tmp/baseline.json
+    python tests/benchmark_product_agent.py --parity-only
+"""
+
+import argparse
+import gc
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+AGENT_DIR = os.path.dirname(TESTS_DIR)
+sys.path.insert(0, AGENT_DIR)
+sys.path.insert(0, TESTS_DIR)
+
+# Size -> (products, order lines)
+SIZES = {
+    '1k': (1000, 10000),
+    '10k': (10000, 100000),
+    '100k': (100000, 1000000),
+    '1m': (1000000, 10000000)
+}
+
+ENGINES = ('python', 'fused', 'columnar')
+
+# Engine the other pipelines are timed against
+REFERENCE_ENGINE = 'python'
+
+# Generated catalog of the parity check: (products, order lines)
+PARITY_SIZE = (2000, 20000)
+
+# Order histories above this many lines are streamed from an NDJSON file
+# (orderHistoryPath) instead of being held in memory
+STREAM_ORDER_LINES = 2000000
+
+
+def _summary(times: list, products: int = None) -> dict:
+    ordered = sorted(times)
+    middle = len(ordered) // 2
+    if len(ordered) % 2:
+        p50 = ordered[middle]
+    else:
+        p50 = (ordered[middle - 1] + ordered[middle]) / 2
+    # Nearest-rank percentile
+    p99 = ordered[min(len(ordered) - 1, max(0, -(-99 * len(ordered) // 100) - 1))]
+    return {
+        'runs': len(times),
+        'firstMs': round(times[0] * 1000, 3),
+        'minMs': round(ordered[0] * 1000, 3),
+        'p50Ms': round(p50 * 1000, 3),
+        'p99Ms': round(p99 * 1000, 3),
+        'productsPerSecond': round(products / p50) if products and p50 > 0 else None
+    }
+
+
+def _measure(fn, repeat: int) -> tuple:
+    """Runs fn repeat times; returns (last result, per-run seconds)."""
+    times = []
+    value = None
+    for _ in range(repeat):
+        # Start every run from the same heap state; garbage left by the
+        # previous run would otherwise be collected during this one
+        value = None
+        gc.collect()
+        started = time.perf_counter()
+        value = fn()
+        times.append(time.perf_counter() - started)
+    return value, times
+
+
+def _peak_rss_mb() -> float:
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def run_size(size: str, repeat: int, engines: tuple, seed: int) -> dict:
+    """
+    Benchmarks one catalog size (runs in a dedicated process).
+
+    Returns:
+        Dictionary with the size, its cases and peak RSS
+    """
+    n_products, n_order_lines = SIZES[size]
+    with tempfile.TemporaryDirectory() as temp_dir:
+        # Streamed orders are referenced from the payload, so their
+        # directory has to be a data root (read when the agent is imported)
+        os.environ['PRODUCT_ANALYSIS_DATA_ROOTS'] = temp_dir
+        import product_analysis_agent as agent
+        from catalog_generator import generate_payload
+
+        orders_file = None
+        if n_order_lines > STREAM_ORDER_LINES:
+            orders_file = os.path.join(temp_dir, 'orders.ndjson')
+
+        started = time.perf_counter()
+        payload = generate_payload(n_products, n_order_lines, seed, orders_file=orders_file)
+        generate_seconds = time.perf_counter() - started
+
+        products = payload['products']
+        current_month = payload['currentMonth']
+        climate_data = payload['climateData']
+        order_history = payload.get('orderHistory', [])
+        orders_source = orders_file or order_history
+
+        cases = {}
+
+        def record(case, fn):
+            value, times = _measure(fn, repeat)
+            cases[case] = _summary(times, n_products)
+            return value
+
+        # Analyzers, in pipeline order
+        sales_index = record('salesIndex', lambda: agent.SalesIndex.from_orders(agent.iter_orders(orders_source)))
+        stock_metrics = record('stock', lambda: agent.StockAnalyzer().analyze(
+            products, order_history, sales_index
+        ))
+        performance_metrics = record('performance', lambda: agent.PerformanceSegmenter().segment(
+            products, stock_metrics, sales_index
+        ))
+        seasonal_metrics = record('seasonal', lambda: agent.SeasonalAnalyzer().analyze(
+            products, current_month, climate_data
+        ))
+
+        recommendation_engine = agent.RecommendationEngine()
+
+        def recommend():
+            return {
+                product['productId']: recommendation_engine.recommend(
+                    product, performance_metrics[product['productId']],
+                    stock_metrics[product['productId']], seasonal_metrics[product['productId']]
+                )
+                for product in products
+            }
+
+        recommendations = record('recommend', recommend)
+        recommendation_metrics = {
+            product_id: {'recommendedAction': action, 'urgencyLevel': urgency}
+            for product_id, (action, urgency) in recommendations.items()
+        }
+        category_insights = record('category', lambda: agent.CategoryAnalyzer().analyze(
+            products, performance_metrics, stock_metrics
+        ))
+        price_segment_analysis = record('price', lambda: agent.PriceSegmentAnalyzer().analyze(
+            products, performance_metrics, stock_metrics
+        ))
+        all_metrics = {
+            'stock_metrics': stock_metrics,
+            'performance_metrics': performance_metrics,
+            'seasonal_metrics': seasonal_metrics,
+            'recommendation_metrics': recommendation_metrics,
+            'category_insights': category_insights,
+            'price_segment_analysis': price_segment_analysis
+        }
+        record('format', lambda: agent.OutputFormatter().format(products, all_metrics))
+
+        # Whole pipeline; the result cache would turn repeats into lookups
+        for engine in engines:
+            orchestrator = agent.AgentOrchestrator(engine=engine, result_cache=agent.ResultCache(maxsize=0))
+            result = record(f'pipeline.{engine}', lambda: orchestrator.execute(payload))
+            if 'error' in result:
+                raise RuntimeError(f'{engine} pipeline failed: {result["error"]}')
+
+    return {
+        'size': size,
+        'products': n_products,
+        'orderLines': n_order_lines,
+        'streamedOrders': orders_file is not None,
+        'generateSeconds': round(generate_seconds, 3),
+        'peakRssMb': _peak_rss_mb(),
+        'cases': cases
+    }
+
+
+def _order_lines(orders: list) -> list:
+    """One row per order line, as in a warehouse export."""
+    return [
+        {'orderId': order.get('orderId'), 'orderDate': order.get('orderDate'),
+         'productId': item.get('productId'), 'quantity': item.get('quantity')}
+        for order in orders for item in order.get('items', [])
+    ]
+
+
+def run_parity(engines: tuple, seed: int) -> dict:
+    """
+    Checks that every engine and catalog source gives the same result
+    (runs in a dedicated process).
+
+    Returns:
+        Dictionary with the number of results compared, the sources skipped
+        for missing dependencies and the differences found
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        # Catalog files are referenced from the payloads (see run_size)
+        os.environ['PRODUCT_ANALYSIS_DATA_ROOTS'] = temp_dir
+        import product_analysis_agent as agent
+        from catalog_generator import generate_payload
+
+        with open(os.path.join(AGENT_DIR, 'test_input_valid.json'), 'r', encoding='utf-8') as f:
+            valid_input = json.load(f)
+        with open(os.path.join(AGENT_DIR, 'test_output_expected.json'), 'r', encoding='utf-8') as f:
+            valid_expected = json.dumps(json.load(f))
+        generated = generate_payload(*PARITY_SIZE, seed)
+
+        pyarrow = agent.optional_module('pyarrow')
+        checked = 0
+        skipped = [] if pyarrow is not None else ['parquet']
+        failures = []
+        for name, payload in (('test_input_valid', valid_input), ('generated', generated)):
+            products = payload['products']
+            orders = payload.get('orderHistory', [])
+            request = {key: value for key, value in payload.items() if key not in ('products', 'orderHistory')}
+            base = os.path.join(temp_dir, name)
+
+            orders_path = base + '.ndjson'
+            with open(orders_path, 'w', encoding='utf-8') as f:
+                for order in orders:
+                    f.write(json.dumps(order) + '\n')
+            snapshot_path = base + '.snap'
+            agent.write_catalog_snapshot(snapshot_path, products, orders)
+            store_path = base + '.db'
+            store = agent.SalesStore(store_path)
+            store.ingest_products(payload['tenantId'], products, replace=True)
+            store.ingest_orders(payload['tenantId'], orders)
+
+            sources = {
+                'inline': (payload, 1),
+                'orderHistoryPath': (dict(request, products=products, orderHistoryPath=orders_path), 1),
+                'catalogSnapshotPath': (dict(request, catalogSnapshotPath=snapshot_path), 1),
+                'salesStorePath': (dict(request, salesStorePath=store_path), 1),
+                'sharded': (payload, 2)
+            }
+            if pyarrow is not None:
+                import pyarrow.parquet as parquet
+                products_path = base + '.parquet'
+                parquet.write_table(pyarrow.Table.from_struct_array(pyarrow.array(products)), products_path)
+                lines_path = base + '.lines.parquet'
+                parquet.write_table(pyarrow.Table.from_pylist(_order_lines(orders), schema=pyarrow.schema([
+                    ('orderId', pyarrow.string()), ('orderDate', pyarrow.string()),
+                    ('productId', pyarrow.string()), ('quantity', pyarrow.int64())
+                ])), lines_path)
+                sources['parquet'] = (dict(request, productsPath=products_path, orderHistoryPath=lines_path), 1)
+
+            reference = agent.AgentOrchestrator(
+                engine='python', result_cache=agent.ResultCache(maxsize=0)
+            ).execute(payload)
+            if 'error' in reference:
+                failures.append(f'{name}/python/inline: {reference["error"]["message"]}')
+                continue
+            reference = json.dumps(reference)
+            if name == 'test_input_valid' and reference != valid_expected:
+                failures.append(f'{name}/python/inline: differs from test_output_expected.json')
+            for engine in engines:
+                for source, (source_payload, shards) in sources.items():
+                    orchestrator = agent.AgentOrchestrator(
+                        engine=engine, shards=shards, result_cache=agent.ResultCache(maxsize=0)
+                    )
+                    # Shard catalogs of any size
+                    orchestrator.SHARD_MIN_PRODUCTS = 1
+                    result = json.dumps(orchestrator.execute(source_payload))
+                    checked += 1
+                    if result != reference:
+                        failures.append(f'{name}/{engine}/{source}: differs from the python inline result')
+
+    return {'checked': checked, 'skipped': skipped, 'failures': failures}
+
+
+def measure_import(repeat: int) -> dict:
+    """Cold import time of the agent module, each run in a new interpreter."""
+    code = (
+        'import time; started = time.perf_counter(); import product_analysis_agent; '
+        'print(time.perf_counter() - started)'
+    )
+    times = []
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, '-c', code], cwd=AGENT_DIR, capture_output=True, text=True, check=True
+        ).stdout
+        times.append(float(output.strip().splitlines()[-1]))
+    return _summary(times, None)
+
+
+def check_parity(engines: tuple, seed: int) -> dict:
+    """Runs run_parity in a fresh process (it sets the data roots before importing the agent)."""
+    from concurrent.futures import ProcessPoolExecutor
+
+    # Unlike multiprocessing.Pool workers, executor workers are not daemonic,
+    # so the sharded cases can start their own worker processes
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+        return pool.submit(run_parity, engines, seed).result()
+
+
+def run_benchmarks(sizes: list, repeat: int, engines: tuple, seed: int) -> dict:
+    """
+    Runs the suite.
+
+    Returns:
+        Report dictionary; cases are keyed "<size>/<case>" (plus "import")
+    """
+    report = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpuCount': os.cpu_count(),
+        'seed': seed,
+        'repeat': repeat,
+        'engines': list(engines),
+        'runs': [],
+        'cases': {'import': measure_import(repeat)}
+    }
+    context = multiprocessing.get_context('spawn')
+    for size in sizes:
+        with context.Pool(1) as pool:
+            run = pool.apply(run_size, (size, repeat, engines, seed))
+        for case, summary in run.pop('cases').items():
+            report['cases'][f'{size}/{case}'] = summary
+        report['runs'].append(run)
+    return report
+
+
+def engine_ratios(report: dict) -> dict:
+    """
+    Pipeline p50 of every engine relative to REFERENCE_ENGINE, per size.
+
+    Returns:
+        Dictionary keyed "<size>/pipeline.<engine>" (reference excluded)
+    """
+    ratios = {}
+    for case, summary in report['cases'].items():
+        size, _, name = case.partition('/')
+        if not name.startswith('pipeline.') or name == f'pipeline.{REFERENCE_ENGINE}':
+            continue
+        reference = report['cases'].get(f'{size}/pipeline.{REFERENCE_ENGINE}')
+        if reference is not None and reference['p50Ms'] > 0:
+            ratios[case] = round(summary['p50Ms'] / reference['p50Ms'], 3)
+    return ratios
+
+
+def compare_ratios(report: dict, max_ratio: float, min_ms: float) -> list:
+    """
+    Engines slower than allowed relative to REFERENCE_ENGINE in the same run.
+
+    Args:
+        max_ratio: Largest allowed engine p50 / reference p50
+        min_ms: Sizes whose reference p50 is below this are too noisy to
+                compare and are skipped
+
+    Returns:
+        List of human-readable regressions (empty when none)
+    """
+    regressions = []
+    for case, ratio in report['ratios'].items():
+        size = case.partition('/')[0]
+        reference = report['cases'][f'{size}/pipeline.{REFERENCE_ENGINE}']
+        if reference['p50Ms'] < min_ms or ratio <= max_ratio:
+            continue
+        regressions.append(
+            f"{case}: p50 {report['cases'][case]['p50Ms']}ms is {ratio}x the {REFERENCE_ENGINE} "
+            f"pipeline ({reference['p50Ms']}ms), above {max_ratio}x"
+        )
+    return regressions
+
+
+def compare(report: dict, baseline: dict, tolerance: float, min_ms: float) -> list:
+    """
+    Cases whose p50 regressed against a baseline of the same machine.
+
+    Args:
+        tolerance: Allowed relative p50 growth (0.5 = 50%)
+        min_ms: Cases faster than this in the baseline are too noisy to
+                compare and are skipped
+
+    Returns:
+        List of human-readable regressions (empty when none)
+    """
+    regressions = []
+    for case, summary in report['cases'].items():
+        reference = baseline.get('cases', {}).get(case)
+        if reference is None or reference['p50Ms'] < min_ms:
+            continue
+        limit = reference['p50Ms'] * (1 + tolerance)
+        if summary['p50Ms'] > limit:
+            regressions.append(
+                f"{case}: p50 {summary['p50Ms']}ms > {limit:.3f}ms "
+                f"(baseline {reference['p50Ms']}ms + {tolerance:.0%})"
+            )
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmark the product analysis agent')
+    parser.add_argument('--sizes', default='1k,10k', help=f'Comma-separated subset of {",".join(SIZES)}')
+    parser.add_argument('--engines', default=','.join(ENGINES))
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='Write the JSON report here (default: stdout)')
+    parser.add_argument('--max-ratio', type=float, default=1.0,
+                        help=f'Largest allowed engine p50 / {REFERENCE_ENGINE} pipeline p50')
+    parser.add_argument('--baseline', help='Report of an earlier run on this machine to compare p50s against')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='Allowed p50 growth against --baseline')
+    parser.add_argument('--min-ms', type=float, default=20.0)
+    parser.add_argument('--update-baseline', action='store_true', help='Store this run as --baseline')
+    parser.add_argument('--parity-only', action='store_true', help='Only run the parity check')
+    parser.add_argument('--skip-parity', action='store_true', help='Do not run the parity check')
+    args = parser.parse_args(argv)
+    if args.update_baseline and not args.baseline:
+        parser.error('--update-baseline requires --baseline')
+
+    sizes = [size.strip() for size in args.sizes.split(',') if size.strip()]
+    unknown = [size for size in sizes if size not in SIZES]
+    if unknown:
+        parser.error(f'unknown sizes: {", ".join(unknown)}')
+    engines = tuple(engine.strip() for engine in args.engines.split(',') if engine.strip())
+
+    parity = None
+    if not args.skip_parity:
+        parity = check_parity(engines, args.seed)
+        for failure in parity['failures']:
+            print(f'PARITY {failure}', file=sys.stderr)
+        if args.parity_only:
+            print(json.dumps(parity, indent=2))
+            return 1 if parity['failures'] else 0
+        if parity['failures']:
+            # Timings of wrong results are not worth comparing or storing
+            print(json.dumps({'parity': parity}, indent=2))
+            return 1
+
+    report = run_benchmarks(sizes, args.repeat, engines, args.seed)
+    if parity is not None:
+        report['parity'] = parity
+
+    report['ratios'] = engine_ratios(report)
+    regressions = compare_ratios(report, args.max_ratio, args.min_ms)
+    if args.update_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+            f.write('\n')
+    elif args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions += compare(report, baseline, args.tolerance, args.min_ms)
+    report['regressions'] = regressions
+    for regression in regressions:
+        print(f'REGRESSION {regression}', file=sys.stderr)
+    status = 1 if regressions else 0
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
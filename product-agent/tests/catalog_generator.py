@@ -0,0 +1,293 @@
+"""
+Synthetic catalog generator for product analysis benchmarks
+
+Produces seeded, reproducible payloads in the product analysis input schema
+(see product-analysis-agent-api.md). The distributions follow
+data/products_2.json: category and lifecycle mix, price bands, cost ratios,
+the share of seasonal products and their rule types. Sales are skewed so a
+few products carry most of the order lines, as in the real order history.
+
+Usage:
+    python catalog_generator.py --products 100000 --order-lines 1000000 > payload.json
+    python catalog_generator.py --products 1000000 --order-lines 10000000 \
+        --orders-file orders.ndjson > payload.json
+"""
+
+import argparse
+import json
+import math
+import random
+import sys
+from bisect import bisect_left
+from datetime import date, timedelta
+
+# Category -> (weight, subcategories), from data/products_2.json
+CATEGORIES = {
+    'SKINCARE': (29, ('Serum', 'Nemlendirici', 'Tonik', 'Gunes Koruma', 'Gece Bakimi')),
+    'PERSONALCARE': (22, ('Dis Bakimi', 'Temizlik', 'Dus Jeli', 'Deodorant')),
+    'MAKEUP': (19, ('Maskara', 'Ruj', 'Kapatici', 'Fondoten', 'BB Krem')),
+    'FRAGRANCE': (15, ('Kadin Parfum', 'Erkek Parfum', 'Vucut Spreyi')),
+    'WELLNESS': (15, ('Vitamin', 'Takviye', 'Kolajen', 'Probiyotik')),
+    'HAIRCARE': (9, ('Sampuan', 'Sac Maskesi', 'Sac Bakimi'))
+}
+
+# lifecycleStage -> (weight, trendScore range)
+LIFECYCLE_STAGES = {
+    'MATURE': (63, (55, 95)),
+    'DECLINING': (14, (25, 60)),
+    'NEW': (13, (70, 99)),
+    'GROWING': (10, (65, 95))
+}
+
+# Price band -> (weight, basePrice range); the bands straddle the default
+# BUDGET (<= 200) and MID (<= 500) boundaries
+PRICE_BANDS = ((70, (19.9, 200.0)), (22, (200.0, 500.0)), (8, (500.0, 1500.0)))
+
+SEASONAL_SHARE = 0.12
+SEASONS = ('WINTER', 'SUMMER', 'SPRING', 'FALL')
+
+# City -> (mean avgTempC, yearly amplitude, humidityPct, monthly rainfallMm)
+CITIES = {
+    'Istanbul': (14.5, 9.5, 72, 70),
+    'Ankara': (12.0, 12.5, 60, 35),
+    'Izmir': (17.5, 10.0, 62, 60),
+    'Antalya': (19.0, 9.5, 64, 90),
+    'Trabzon': (14.5, 8.5, 75, 70),
+    'Bursa': (14.5, 10.0, 70, 60),
+    'Adana': (19.5, 10.5, 66, 55),
+    'Konya': (11.5, 12.5, 58, 30),
+    'Gaziantep': (15.5, 12.5, 55, 45),
+    'Erzurum': (5.5, 15.0, 65, 40)
+}
+
+DEFAULT_AS_OF = date(2026, 2, 12)
+HISTORY_DAYS = 90
+
+
+def _weighted(rng: random.Random, table: dict):
+    keys = list(table)
+    return rng.choices(keys, weights=[table[key][0] for key in keys])[0]
+
+
+def climate_for_month(month: int) -> dict:
+    """
+    climateData for a month: a sinusoidal yearly temperature profile per
+    city, coldest in January.
+    """
+    phase = math.cos(2 * math.pi * (month - 1) / 12)
+    climate = {}
+    for city, (mean_temp, amplitude, humidity, rainfall) in CITIES.items():
+        avg_temp = round(mean_temp - amplitude * phase, 1)
+        if month in (12, 1, 2):
+            season_tag = 'winter'
+        elif month in (6, 7, 8):
+            season_tag = 'summer'
+        elif month in (3, 4, 5):
+            season_tag = 'spring'
+        else:
+            season_tag = 'fall'
+        climate[city] = {
+            'month': month,
+            'avgTempC': avg_temp,
+            'humidityPct': humidity + round(6 * phase),
+            'rainfallMm': max(5, round(rainfall * (1 + 0.6 * phase))),
+            'seasonTag': season_tag
+        }
+    return climate
+
+
+def _seasonality_rules(rng: random.Random, season_code: str) -> list:
+    rules = [{'ruleType': 'SEASON_TAG', 'threshold': 0, 'thresholdText': season_code.lower()}]
+    if season_code == 'WINTER':
+        if rng.random() < 0.6:
+            threshold = rng.choice((5, 10, 15))
+            rules.append({'ruleType': 'LOW_TEMP', 'threshold': threshold, 'thresholdText': f'temp < {threshold}C'})
+        if rng.random() < 0.5:
+            threshold = rng.choice((60, 65, 70))
+            rules.append({'ruleType': 'HIGH_HUMIDITY', 'threshold': threshold,
+                          'thresholdText': f'humidity > {threshold}%'})
+    elif season_code in ('SPRING', 'FALL') and rng.random() < 0.4:
+        threshold = rng.choice((50, 80, 100))
+        rules.append({'ruleType': 'HIGH_RAINFALL', 'threshold': threshold, 'thresholdText': f'rain > {threshold}mm'})
+    return rules
+
+
+def generate_products(n_products: int, seed: int = 42) -> list:
+    """
+    Seeded product catalog.
+
+    Args:
+        n_products: Number of products
+        seed: Random seed; the same seed always yields the same catalog
+
+    Returns:
+        List of product dictionaries (unique productIds)
+    """
+    rng = random.Random(seed)
+    price_weights = [weight for weight, _ in PRICE_BANDS]
+    products = []
+    for index in range(n_products):
+        category = _weighted(rng, CATEGORIES)
+        subcategory = rng.choice(CATEGORIES[category][1])
+        lifecycle_stage = _weighted(rng, LIFECYCLE_STAGES)
+        low, high = LIFECYCLE_STAGES[lifecycle_stage][1]
+        _, (price_low, price_high) = rng.choices(PRICE_BANDS, weights=price_weights)[0]
+        # Shelf prices end in .9 (89.9, 249.9)
+        base_price = math.floor(rng.uniform(price_low, price_high)) + 0.9
+        cost = round(base_price * rng.uniform(0.3, 0.8), 2)
+        stock = rng.choice((rng.randint(0, 60), rng.randint(50, 900)))
+        if rng.random() < SEASONAL_SHARE:
+            season_code = rng.choice(SEASONS)
+            rules = _seasonality_rules(rng, season_code)
+        else:
+            season_code = 'all'
+            rules = []
+
+        products.append({
+            'productId': f'{9000000 + index}',
+            'productName': f'{subcategory} {index}',
+            'category': category,
+            'subcategory': subcategory,
+            'brand': 'Farmasi',
+            'season': season_code.lower(),
+            'isSeasonal': season_code != 'all',
+            'seasonCode': season_code,
+            'stock': stock,
+            'currentStock': stock,
+            'last30DaysSales': rng.randint(0, 400),
+            'cost': cost,
+            'unitCost': cost,
+            'basePrice': base_price,
+            'unitPrice': base_price,
+            'lifecycleStage': lifecycle_stage,
+            'trendScore': rng.randint(low, high),
+            'tags': [subcategory.lower().replace(' ', '-')],
+            'seasonalityRules': rules
+        })
+    return products
+
+
+def _popularity_weights(rng: random.Random, n: int) -> list:
+    """Cumulative Pareto popularity weights of n products."""
+    weights = []
+    total = 0.0
+    for _ in range(n):
+        total += rng.paretovariate(1.2)
+        weights.append(total)
+    return weights
+
+
+def iter_generated_orders(products: list, n_order_lines: int, seed: int = 42,
+                          as_of: date = DEFAULT_AS_OF):
+    """
+    Seeded order history.
+
+    Product popularity follows a Pareto distribution and orders hold 1-8
+    lines, dated within the HISTORY_DAYS before as_of.
+
+    Args:
+        products: Catalog the orders refer to
+        n_order_lines: Total number of order lines (items)
+        seed: Random seed
+        as_of: Latest orderDate
+
+    Yields:
+        Order dictionaries
+    """
+    if not products:
+        return
+    rng = random.Random(seed + 1)
+    weights = _popularity_weights(rng, len(products))
+    total_weight = weights[-1]
+    product_ids = [product['productId'] for product in products]
+    prices = [product['basePrice'] for product in products]
+
+    lines = 0
+    order_number = 0
+    while lines < n_order_lines:
+        size = min(rng.randint(1, 8), n_order_lines - lines)
+        items = []
+        for _ in range(size):
+            index = bisect_left(weights, rng.random() * total_weight)
+            items.append({
+                'productId': product_ids[index],
+                'quantity': rng.randint(1, 12),
+                'unitPrice': prices[index]
+            })
+        order_number += 1
+        lines += size
+        yield {
+            'orderId': f'ORD-{order_number}',
+            'orderDate': (as_of - timedelta(days=rng.randrange(HISTORY_DAYS))).isoformat(),
+            'customerId': f'C{rng.randrange(max(1, n_order_lines // 20)):06d}',
+            'items': items
+        }
+
+
+def generate_payload(n_products: int, n_order_lines: int, seed: int = 42, current_month: int = 2,
+                     orders_file: str = None, tenant_id: str = 'farmasi') -> dict:
+    """
+    Complete analysis request.
+
+    Args:
+        n_products: Catalog size
+        n_order_lines: Order lines in the history
+        seed: Random seed
+        current_month: currentMonth of the request (climateData follows it)
+        orders_file: When given, orders are written to this NDJSON file and
+                     referenced through orderHistoryPath instead of being
+                     held in memory (for multi-million line histories)
+        tenant_id: tenantId of the request
+
+    Returns:
+        Payload dictionary in the input schema
+    """
+    products = generate_products(n_products, seed)
+    payload = {
+        'tenantId': tenant_id,
+        'products': products,
+        'currentMonth': current_month,
+        'climateData': climate_for_month(current_month)
+    }
+    orders = iter_generated_orders(products, n_order_lines, seed)
+    if orders_file:
+        write_orders_ndjson(orders, orders_file)
+        payload['orderHistoryPath'] = orders_file
+    else:
+        payload['orderHistory'] = list(orders)
+    return payload
+
+
+def write_orders_ndjson(orders, path: str) -> int:
+    """
+    Writes orders one per line.
+
+    Returns:
+        Number of orders written
+    """
+    count = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        for order in orders:
+            f.write(json.dumps(order, separators=(',', ':')))
+            f.write('\n')
+            count += 1
+    return count
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Generate a synthetic product analysis payload')
+    parser.add_argument('--products', type=int, default=1000)
+    parser.add_argument('--order-lines', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--month', type=int, default=2)
+    parser.add_argument('--orders-file', help='Write orders to this NDJSON file (orderHistoryPath)')
+    args = parser.parse_args(argv)
+
+    payload = generate_payload(args.products, args.order_lines, args.seed, args.month, args.orders_file)
+    json.dump(payload, sys.stdout, separators=(',', ':'))
+    sys.stdout.write('\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,84 @@
+"""
+Category and price-segment running totals
+
+Removing a contribution must undo its add, and merging partial aggregates
+must give the totals of one aggregate over all contributions. Integer totals
+are compared exactly.
+"""
+
+import os
+import random
+import sys
+
+import pytest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+
+from product_analysis_agent import (  # noqa: E402
+    PERFORMANCE_SEGMENTS,
+    STOCK_SEGMENTS,
+    CategoryAggregate,
+    PriceSegmentAggregate,
+)
+
+
+def _category_rows(seed: int, n: int = 200) -> list:
+    rng = random.Random(seed)
+    return [(rng.randint(20, 99), rng.randint(0, 500), rng.randint(0, 999),
+             rng.choice(PERFORMANCE_SEGMENTS + ('Unknown',))) for _ in range(n)]
+
+
+def _price_rows(seed: int, n: int = 200) -> list:
+    rng = random.Random(seed)
+    return [(rng.randint(20, 99), rng.choice(STOCK_SEGMENTS)) for _ in range(n)]
+
+
+def _fill(aggregate, rows):
+    for row in rows:
+        aggregate.add(*row)
+    return aggregate
+
+
+@pytest.mark.parametrize('aggregate_type, rows', [
+    (CategoryAggregate, _category_rows(0)),
+    (PriceSegmentAggregate, _price_rows(0)),
+])
+def test_remove_undoes_add(aggregate_type, rows):
+    kept, removed = rows[:120], rows[120:]
+    aggregate = _fill(aggregate_type(), rows)
+    for row in removed:
+        aggregate.remove(*row)
+    assert aggregate.as_tuple() == _fill(aggregate_type(), kept).as_tuple()
+    for row in kept:
+        aggregate.remove(*row)
+    assert aggregate.as_tuple() == aggregate_type().as_tuple()
+
+
+@pytest.mark.parametrize('aggregate_type, rows', [
+    (CategoryAggregate, _category_rows(1)),
+    (PriceSegmentAggregate, _price_rows(1)),
+])
+def test_merge_matches_single_aggregate(aggregate_type, rows):
+    merged = aggregate_type()
+    for start in range(0, len(rows), 70):
+        merged.merge(_fill(aggregate_type(), rows[start:start + 70]))
+    merged.merge(aggregate_type())
+    assert merged.as_tuple() == _fill(aggregate_type(), rows).as_tuple()
+
+
+def test_category_performer_counts():
+    aggregate = _fill(CategoryAggregate(), [
+        (90, 10, 5, 'Star'), (85, 0, 0, 'Rising'), (40, 3, 200, 'Underperformer'), (60, 1, 30, 'Steady')
+    ])
+    assert aggregate.as_tuple() == (4, 275, 14, 235, 2, 1)
+    aggregate.remove(85, 0, 0, 'Rising')
+    aggregate.remove(40, 3, 200, 'Underperformer')
+    assert aggregate.as_tuple() == (2, 150, 11, 35, 1, 0)
+
+
+def test_price_segment_healthy_count():
+    aggregate = _fill(PriceSegmentAggregate(), [(90, 'Healthy'), (40, 'Critical'), (60, 'Healthy')])
+    assert aggregate.as_tuple() == (3, 190, 2)
+    aggregate.remove(90, 'Healthy')
+    assert aggregate.as_tuple() == (2, 100, 1)
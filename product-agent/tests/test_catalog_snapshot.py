@@ -0,0 +1,90 @@
+"""
+Catalog snapshots
+
+A request naming a catalog snapshot must return the result of the same
+request with inline products and orders. A process reuses its mapping of an
+unchanged snapshot, but not of a file rewritten with its old mtime, whose
+stale digest would also let the result cache answer with the old result.
+"""
+
+import json
+import os
+import sys
+
+import pytest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+sys.path.insert(0, TESTS_DIR)
+
+import product_analysis_agent as agent  # noqa: E402
+from catalog_generator import generate_payload  # noqa: E402
+
+
+@pytest.fixture
+def payload(tmp_path, monkeypatch):
+    monkeypatch.setattr(agent, 'DATA_ROOTS', (str(tmp_path),))
+    return generate_payload(200, 2000, 0)
+
+
+def _snapshot_request(payload: dict, path: str) -> dict:
+    request = {field: value for field, value in payload.items() if field not in ('products', 'orderHistory')}
+    request['catalogSnapshotPath'] = path
+    return request
+
+
+def _execute(request: dict, result_cache=None) -> str:
+    cache = agent.ResultCache(maxsize=0) if result_cache is None else result_cache
+    return json.dumps(agent.AgentOrchestrator('fused', result_cache=cache).execute(request))
+
+
+def _restocked(payload: dict) -> dict:
+    return dict(payload, products=[dict(product, stock=product['stock'] + 7) for product in payload['products']])
+
+
+def _write_in_place(payload: dict, path: str, scratch: str) -> None:
+    """Rewrites path with the snapshot of payload, keeping its inode and times."""
+    stat = os.stat(path)
+    agent.write_catalog_snapshot(scratch, payload['products'], payload['orderHistory'])
+    assert os.path.getsize(scratch) == stat.st_size
+    with open(scratch, 'rb') as source, open(path, 'r+b') as target:
+        target.write(source.read())
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+
+def test_snapshot_matches_inline_request(payload, tmp_path):
+    path = str(tmp_path / 'catalog.snap')
+    agent.write_catalog_snapshot(path, payload['products'], payload['orderHistory'])
+    assert _execute(_snapshot_request(payload, path)) == _execute(payload)
+
+
+def test_unchanged_snapshot_is_reused(payload, tmp_path):
+    path = str(tmp_path / 'catalog.snap')
+    agent.write_catalog_snapshot(path, payload['products'])
+    assert agent.open_catalog_snapshot(path) is agent.open_catalog_snapshot(path)
+
+
+def test_replaced_snapshot_with_old_mtime(payload, tmp_path):
+    path = str(tmp_path / 'catalog.snap')
+    agent.write_catalog_snapshot(path, payload['products'], payload['orderHistory'])
+    stat = os.stat(path)
+    first = agent.open_catalog_snapshot(path)
+
+    restocked = _restocked(payload)
+    agent.write_catalog_snapshot(path, restocked['products'], restocked['orderHistory'])
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    second = agent.open_catalog_snapshot(path)
+    assert second is not first and second.digest != first.digest
+    assert _execute(_snapshot_request(restocked, path)) == _execute(restocked)
+
+
+def test_snapshot_rewritten_in_place_with_old_mtime(payload, tmp_path):
+    path = str(tmp_path / 'catalog.snap')
+    agent.write_catalog_snapshot(path, payload['products'], payload['orderHistory'])
+    cache = agent.ResultCache(maxsize=8)
+    request = _snapshot_request(payload, path)
+    assert _execute(request, cache) == _execute(payload)
+
+    restocked = _restocked(payload)
+    _write_in_place(restocked, path, str(tmp_path / 'scratch.snap'))
+    assert _execute(request, cache) == _execute(restocked)
@@ -0,0 +1,70 @@
+"""
+extract_json copies
+
+The agent deploys as a single file and carries its own copy of the
+repository's json_extract scanner; both must return the same values for
+every text and option.
+"""
+
+import importlib.util
+import itertools
+import os
+import sys
+
+import pytest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+AGENT_DIR = os.path.dirname(TESTS_DIR)
+sys.path.insert(0, AGENT_DIR)
+
+from product_analysis_agent import extract_json  # noqa: E402
+
+_spec = importlib.util.spec_from_file_location(
+    'json_extract', os.path.join(os.path.dirname(AGENT_DIR), 'json_extract.py')
+)
+json_extract = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(json_extract)
+
+TEXTS = [
+    '',
+    'no json here',
+    '{"a": 1}',
+    'Result: {"a": 1} trailing',
+    'Steps: [1, 2, 3]. Result: {"a": 1}',
+    'Rows: [{"a": 1}, {"b": 2}]',
+    'Rows: [{"a": 1}, {"b": 2}] and {"c": 3}',
+    'Only [1, 2] and [3]',
+    'a stray { then {"ok": true} and ]',
+    'broken {"a": } then {"b": "}"}',
+    'quotes "in {prose}" then {"x": "y \\" }"}',
+    '[[{"deep": 1}]] {"top": 2}',
+    '{"unclosed": [1, 2 {"inner": 3}',
+    '[unclosed {"a": 1} [2, 3]',
+    '] } {"after": "closers"}',
+    '{' * 5000 + '"a"',
+    '[' * 3000 + ']' * 3000,
+]
+
+
+@pytest.mark.parametrize('text', TEXTS)
+def test_copies_agree(text):
+    for allow_array, prefer_object in itertools.product((True, False), repeat=2):
+        assert extract_json(text, allow_array=allow_array, prefer_object=prefer_object) == \
+            json_extract.extract_json(text, allow_array=allow_array, prefer_object=prefer_object)
+
+
+def test_copies_share_the_size_limit():
+    assert extract_json.__defaults__ == json_extract.extract_json.__defaults__
+    for extract in (extract_json, json_extract.extract_json):
+        with pytest.raises(ValueError):
+            extract('{"a": 1}', max_chars=4)
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('Steps: [1, 2, 3]. Result: {"a": 1}', {'a': 1}),
+    ('Rows: [{"a": 1}, {"b": 2}]', [{'a': 1}, {'b': 2}]),
+    ('Rows: [{"a": 1}] and {"c": 3}', {'c': 3}),
+    ('Only [1, 2] and [3]', [1, 2]),
+])
+def test_prefer_object(text, expected):
+    assert extract_json(text, prefer_object=True) == expected
@@ -0,0 +1,77 @@
+"""
+Incremental stock analysis
+
+An IncrementalStockAnalyzer fed orders in batches and moved forward day by
+day must report the same metrics and insights as one built from scratch over
+the same orders and window.
+"""
+
+import os
+import sys
+from datetime import date, timedelta
+
+import pytest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+sys.path.insert(0, TESTS_DIR)
+
+from catalog_generator import generate_payload  # noqa: E402
+from product_analysis_agent import IncrementalStockAnalyzer  # noqa: E402
+
+RESULTS = ('stock_metrics', 'performance_metrics', 'category_insights', 'price_segment_analysis')
+
+
+def _payload(seed: int):
+    payload = generate_payload(300, 3000, seed)
+    orders = sorted(payload['orderHistory'], key=lambda order: order['orderDate'])
+    last_day = date.fromisoformat(orders[-1]['orderDate'][:10])
+    return payload['products'], orders, last_day
+
+
+def _assert_same(incremental, full):
+    for name in RESULTS:
+        assert getattr(incremental, name) == getattr(full, name), name
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_apply_orders_matches_full_recompute(seed):
+    products, orders, last_day = _payload(seed)
+    incremental = IncrementalStockAnalyzer(products, orders[:len(orders) // 2], current_day=last_day)
+    for start in range(len(orders) // 2, len(orders), 200):
+        incremental.apply_orders(orders[start:start + 200])
+    _assert_same(incremental, IncrementalStockAnalyzer(products, orders, current_day=last_day))
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_advance_day_matches_full_recompute(seed):
+    products, orders, last_day = _payload(seed)
+    incremental = IncrementalStockAnalyzer(products, orders, window_days=30, current_day=last_day)
+    for days in range(1, 40, 7):
+        incremental.advance_day(7)
+        full = IncrementalStockAnalyzer(products, orders, window_days=30,
+                                        current_day=last_day + timedelta(days=days + 6))
+        _assert_same(incremental, full)
+
+
+def test_refresh_reports_touched_products_only():
+    products, orders, last_day = _payload(0)
+    incremental = IncrementalStockAnalyzer(products, orders, current_day=last_day)
+    product_id = products[0]['productId']
+    touched = incremental.apply_orders([{
+        'orderId': 'ORD-NEW',
+        'items': [{'productId': product_id, 'quantity': 3}, {'productId': 'UNKNOWN', 'quantity': 1}]
+    }])
+    assert touched == {product_id}
+    assert incremental.advance_day(0) == set()
+
+
+def test_unreadable_order_dates_are_skipped():
+    products, orders, last_day = _payload(1)
+    incremental = IncrementalStockAnalyzer(products, orders, current_day=last_day)
+    assert incremental.apply_orders([{
+        'orderId': 'ORD-BAD',
+        'orderDate': 'not a date',
+        'items': [{'productId': products[0]['productId'], 'quantity': 3}]
+    }]) == set()
+    _assert_same(incremental, IncrementalStockAnalyzer(products, orders, current_day=last_day))
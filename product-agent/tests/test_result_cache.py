@@ -0,0 +1,80 @@
+"""
+Result cache
+
+Results read back from either tier must equal the stored result; the disk
+tier keeps at most disk_maxsize files and drops the least recently read
+ones first.
+"""
+
+import os
+import sys
+import time
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+sys.path.insert(0, TESTS_DIR)
+
+from catalog_generator import generate_payload  # noqa: E402
+from product_analysis_agent import AgentOrchestrator, ResultCache  # noqa: E402
+
+
+def _result(category=None) -> dict:
+    return {'summary': {'totalProducts': 2, 'avgTrendScore': 71.5},
+            'categoryInsights': {category or 'SKINCARE': {'totalProducts': 2}},
+            'topProducts': [{'productId': 'P1', 'stockDays': 12.25}]}
+
+
+def _files(directory) -> set:
+    return {name[:-len('.json')] for name in os.listdir(directory) if name.endswith('.json')}
+
+
+def test_disk_round_trip(tmp_path):
+    ResultCache(maxsize=0, directory=str(tmp_path)).set('k1', _result())
+    cache = ResultCache(maxsize=4, directory=str(tmp_path))
+    assert cache.get('k1') == _result()
+    assert cache.get('k2') is None
+    assert cache.stats()['diskHits'] == 1 and cache.stats()['diskMisses'] == 1
+    # Served from memory from now on, as a fresh copy each time
+    os.remove(tmp_path / 'k1.json')
+    first = cache.get('k1')
+    first['summary']['totalProducts'] = 0
+    assert cache.get('k1') == _result()
+
+
+def test_non_string_keys_stay_in_memory(tmp_path):
+    cache = ResultCache(maxsize=4, directory=str(tmp_path))
+    cache.set('k1', _result(category=7))
+    assert _files(tmp_path) == set()
+    assert cache.get('k1') == _result(category=7)
+
+
+def test_orchestrator_results_survive_the_disk_tier(tmp_path):
+    payload = generate_payload(60, 400, 0)
+    for index, product in enumerate(payload['products']):
+        product['category'] = index % 3
+    results = [
+        AgentOrchestrator('fused', result_cache=ResultCache(maxsize=0, directory=str(tmp_path))).execute(payload)
+        for _ in range(2)
+    ]
+    assert results[0] == results[1]
+    assert list(results[1]['categoryInsights']) == [0, 1, 2]
+
+
+def test_least_recently_read_files_are_evicted(tmp_path):
+    cache = ResultCache(maxsize=0, directory=str(tmp_path), disk_maxsize=2)
+    cache.set('k1', _result())
+    cache.set('k2', _result())
+    os.utime(tmp_path / 'k1.json', (1000, time.time()))
+    os.utime(tmp_path / 'k2.json', (2000, time.time()))
+    assert cache.get('k1') == _result()
+    cache.set('k3', _result())
+    assert _files(tmp_path) == {'k1', 'k3'}
+
+
+def test_expired_files_are_removed(tmp_path):
+    cache = ResultCache(maxsize=0, ttl=60, directory=str(tmp_path))
+    cache.set('k1', _result())
+    written = time.time() - 120
+    os.utime(tmp_path / 'k1.json', (written, written))
+    assert cache.get('k1') is None
+    assert _files(tmp_path) == set()
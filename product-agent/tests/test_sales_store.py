@@ -0,0 +1,113 @@
+"""
+Sales store
+
+Requests served from a SalesStore must return the result of the same
+request with inline products and orders, and window queries must read
+exactly the rollups of the window's days.
+"""
+
+import json
+import os
+import sys
+from datetime import date
+
+import pytest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+sys.path.insert(0, TESTS_DIR)
+
+import product_analysis_agent as agent  # noqa: E402
+from catalog_generator import generate_payload  # noqa: E402
+
+TENANT = 'farmasi'
+UNDATED_ORDER = {'orderId': 'ORD-UNDATED', 'items': [{'productId': 'P-UNDATED', 'quantity': 4}]}
+
+
+@pytest.fixture
+def payload(tmp_path, monkeypatch):
+    monkeypatch.setattr(agent, 'DATA_ROOTS', (str(tmp_path),))
+    return generate_payload(200, 2000, 0, tenant_id=TENANT)
+
+
+@pytest.fixture
+def store(payload, tmp_path):
+    store = agent.SalesStore(str(tmp_path / 'sales.db'))
+    store.ingest_products(TENANT, payload['products'], replace=True)
+    store.ingest_orders(TENANT, payload['orderHistory'] + [UNDATED_ORDER])
+    return store
+
+
+def _index(orders, days: int = 90) -> agent.SalesIndex:
+    index = agent.SalesIndex.from_orders(orders)
+    index.days = days
+    return index
+
+
+def _assert_same_sales(index, expected):
+    assert (index.totals, index.daily, index.days) == (expected.totals, expected.daily, expected.days)
+
+
+def _window(orders, date_from=None, date_to=None) -> list:
+    return [
+        order for order in orders
+        if order.get('orderDate')
+        and (date_from is None or order['orderDate'][:10] >= date_from)
+        and (date_to is None or order['orderDate'][:10] <= date_to)
+    ]
+
+
+def test_store_request_matches_inline_request(payload, store):
+    request = {field: value for field, value in payload.items() if field not in ('products', 'orderHistory')}
+    request['salesStorePath'] = store.path
+    inline = dict(payload, orderHistory=payload['orderHistory'] + [UNDATED_ORDER])
+    for engine in ('python', 'fused', 'columnar'):
+        expected = agent.AgentOrchestrator(engine, result_cache=agent.ResultCache(maxsize=0)).execute(inline)
+        assert json.dumps(agent.AgentOrchestrator(engine).execute(request)) == json.dumps(expected), engine
+
+
+def test_whole_history_includes_undated_orders(payload, store):
+    _assert_same_sales(store.sales_index(TENANT), _index(payload['orderHistory'] + [UNDATED_ORDER]))
+
+
+@pytest.mark.parametrize('date_from, date_to', [
+    ('2025-12-01', '2025-12-31'),
+    ('2026-02-12', '2026-02-12'),
+    ('2026-03-01', '2026-03-31'),
+])
+def test_window_reads_the_days_of_the_window(payload, store, date_from, date_to):
+    days = (date.fromisoformat(date_to) - date.fromisoformat(date_from)).days + 1
+    _assert_same_sales(store.sales_index(TENANT, date_from, date_to),
+                       _index(_window(payload['orderHistory'], date_from, date_to), days))
+
+
+@pytest.mark.parametrize('date_from, date_to', [('2026-01-01', None), (None, '2025-12-15')])
+def test_open_ended_window_keeps_the_default_period(payload, store, date_from, date_to):
+    _assert_same_sales(store.sales_index(TENANT, date_from, date_to),
+                       _index(_window(payload['orderHistory'], date_from, date_to)))
+
+
+def test_window_request_rates_are_per_window_day(payload, store):
+    request = {'tenantId': TENANT, 'salesStorePath': store.path, 'salesFrom': '2025-12-01',
+               'salesTo': '2025-12-31', 'currentMonth': payload['currentMonth'],
+               'climateData': payload['climateData']}
+    totals = _index(_window(payload['orderHistory'], '2025-12-01', '2025-12-31')).totals
+    result = agent.AgentOrchestrator('fused').execute(request)
+    rated = [product for field in ('heroProducts', 'slowMovers') for product in result[field]
+             if 'dailySalesRate' in product]
+    assert rated
+    for product in rated:
+        assert product['dailySalesRate'] == pytest.approx(totals.get(product['productId'], 0) / 31)
+
+
+def test_ingestion_invalidates_cached_reads(payload, store):
+    before = store.sales_index(TENANT, '2026-02-01', '2026-02-28')
+    assert store.ingest_orders(TENANT, payload['orderHistory']) == 0
+    assert store.sales_index(TENANT, '2026-02-01', '2026-02-28') is not before
+
+    product_id = payload['products'][0]['productId']
+    store.ingest_orders(TENANT, [{'orderId': 'ORD-NEW', 'orderDate': '2026-02-20',
+                                  'items': [{'productId': product_id, 'quantity': 5}]}])
+    after = store.sales_index(TENANT, '2026-02-01', '2026-02-28')
+    assert after.totals[product_id] == before.totals.get(product_id, 0) + 5
+    assert after.daily[product_id]['2026-02-20'] == before.daily.get(product_id, {}).get('2026-02-20', 0) + 5
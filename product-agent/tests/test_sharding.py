@@ -0,0 +1,59 @@
+"""
+Sharded analysis parity
+
+A sharded AgentOrchestrator must return exactly the unsharded result,
+including the float averages of the category, price-segment and inventory
+insights, on catalogs whose trend scores, stocks and costs are not integers.
+"""
+
+import json
+import os
+import random
+import sys
+
+import pytest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+sys.path.insert(0, TESTS_DIR)
+
+from catalog_generator import generate_payload  # noqa: E402
+from product_analysis_agent import AgentOrchestrator, ResultCache  # noqa: E402
+
+
+def _float_payload(seed: int) -> dict:
+    payload = generate_payload(3000, 20000, seed)
+    rng = random.Random(seed)
+    for product in payload['products']:
+        product['trendScore'] = round(rng.uniform(20, 99), 3)
+        product['stock'] = round(rng.uniform(0, 500), 2)
+        product['cost'] = rng.uniform(1, 300)
+    return payload
+
+
+def _analyze(payload: dict, shards: int = 1) -> str:
+    orchestrator = AgentOrchestrator('fused', shards=shards, result_cache=ResultCache(maxsize=0))
+    orchestrator.SHARD_MIN_PRODUCTS = 1
+    return json.dumps(orchestrator.execute(payload))
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_sharded_output_is_identical(seed):
+    payload = _float_payload(seed)
+    expected = _analyze(payload)
+    for shards in (2, 3, 4):
+        assert _analyze(payload, shards) == expected, 'shards=%d' % shards
+
+
+def test_shards_without_sales_keep_the_total_sales_rate():
+    # Only the first shard sells; the others must not fall back to
+    # last30DaysSales, which only applies when no sales were supplied at all
+    payload = _float_payload(3)
+    payload['orderHistory'] = [{
+        'orderId': 'ORD-1',
+        'orderDate': '2024-01-05',
+        'items': [{'productId': payload['products'][0]['productId'], 'quantity': 5}]
+    }]
+    expected = _analyze(payload)
+    for shards in (2, 4):
+        assert _analyze(payload, shards) == expected, 'shards=%d' % shards
@@ -0,0 +1,137 @@
+"""
+Threshold profiles
+
+The compiled classifiers must put values exactly on a threshold, and the
+nearest floats on either side of it, in the same band as the comparisons
+they replace: stock days Critical (< critical) / Healthy (<= threshold) /
+Excess, margins with exclusive lower bounds, prices BUDGET (<= budget max) /
+MID (<= mid max) / PREMIUM.
+"""
+
+import math
+import os
+import sys
+
+import pytest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+
+from product_analysis_agent import DEFAULT_THRESHOLDS, PriceSegmentAnalyzer, ThresholdProfile  # noqa: E402
+
+PROFILES = [
+    DEFAULT_THRESHOLDS,
+    ThresholdProfile({'criticalStockDays': 10.5, 'stockDaysThreshold': 45, 'starStockDays': 20,
+                      'steadyStockDays': 40, 'marginFloor': 30, 'goodMargin': 30, 'excellentMargin': 55.5,
+                      'budgetPriceMax': 149.5, 'midPriceMax': 400}),
+    ThresholdProfile({'criticalStockDays': 30, 'stockDaysThreshold': 30, 'budgetPriceMax': 250,
+                      'midPriceMax': 250}),
+]
+
+
+def _around(value) -> tuple:
+    return (math.nextafter(value, -math.inf), value, math.nextafter(value, math.inf))
+
+
+def _expected_stock_segment(profile, stock_days):
+    if stock_days < profile.critical_stock_days:
+        return 'Critical'
+    if stock_days <= profile.excess_stock_days:
+        return 'Healthy'
+    return 'Excess'
+
+
+def _expected_margin_health(profile, margin):
+    if margin > profile.excellent_margin:
+        return 'EXCELLENT'
+    if margin > profile.good_margin:
+        return 'GOOD'
+    if margin > profile.moderate_margin:
+        return 'MODERATE'
+    return 'POOR'
+
+
+def _expected_price_segment(profile, base_price):
+    if base_price <= profile.budget_price_max:
+        return 'BUDGET'
+    if base_price <= profile.mid_price_max:
+        return 'MID'
+    return 'PREMIUM'
+
+
+@pytest.mark.parametrize('profile', PROFILES)
+def test_stock_segment_boundaries(profile):
+    values = _around(profile.critical_stock_days) + _around(profile.excess_stock_days) + (0, 999.0, math.inf)
+    for stock_days in values:
+        assert profile.classify_stock_segment(stock_days) == _expected_stock_segment(profile, stock_days), stock_days
+
+
+@pytest.mark.parametrize('profile', PROFILES)
+def test_margin_health_boundaries(profile):
+    for bound in (profile.moderate_margin, profile.good_margin, profile.excellent_margin):
+        for margin in _around(bound):
+            # A base price of 100 makes the margin 100 - cost
+            cost = 100 - margin
+            expected_margin = (100 - cost) / 100 * 100
+            assert profile.calculate_margin_health(cost, 100) == (
+                expected_margin, _expected_margin_health(profile, expected_margin)
+            ), margin
+    assert profile.calculate_margin_health(10, 0) == (0.0, 'POOR')
+
+
+@pytest.mark.parametrize('profile', PROFILES)
+def test_price_segment_boundaries(profile):
+    for base_price in _around(profile.budget_price_max) + _around(profile.mid_price_max) + (0,):
+        assert profile.classify_price_segment(base_price) == _expected_price_segment(profile, base_price), base_price
+
+
+@pytest.mark.parametrize('profile', PROFILES)
+def test_performance_boundaries(profile):
+    stock_days_values = _around(profile.star_stock_days) + _around(profile.steady_stock_days)
+    trend_scores = (_around(profile.rising_trend_score) + _around(profile.star_trend_score)
+                    + _around(profile.steady_trend_score))
+    for lifecycle_stage in ('NEW', 'MATURE'):
+        for trend_score in trend_scores:
+            for stock_days in stock_days_values:
+                if lifecycle_stage == 'NEW' and trend_score > profile.rising_trend_score:
+                    expected = 'Rising'
+                elif trend_score > profile.star_trend_score and stock_days < profile.star_stock_days:
+                    expected = 'Star'
+                elif (profile.steady_trend_score <= trend_score <= profile.star_trend_score
+                      and stock_days < profile.steady_stock_days):
+                    expected = 'Steady'
+                else:
+                    expected = 'Underperformer'
+                assert profile.classify_performance(lifecycle_stage, trend_score, stock_days) == expected
+
+
+@pytest.mark.parametrize('settings, labels', [
+    ({}, ('0-200 TL', '200-500 TL', '500+ TL')),
+    ({'budgetPriceMax': 149.5, 'midPriceMax': 400.0}, ('0-149.5 TL', '149.5-400 TL', '400+ TL')),
+    ({'budgetPriceMax': 250, 'midPriceMax': 250}, ('0-250 TL', '250-250 TL', '250+ TL')),
+])
+def test_price_range_labels(settings, labels):
+    profile = ThresholdProfile.compile(settings)
+    assert tuple(profile.price_ranges.values()) == labels
+    analyzer = PriceSegmentAnalyzer(profile)
+    assert tuple(analyzer.summarize(segment, 0, 0, 0)['priceRange'] for segment in profile.price_ranges) == labels
+
+
+@pytest.mark.parametrize('settings', [
+    {'criticalStockDays': 61},
+    {'marginFloor': 41},
+    {'goodMargin': 61},
+    {'budgetPriceMax': 500.5},
+    {'midPriceMax': True},
+    {'marginFloor': '25'},
+    {'premiumPriceMin': 500},
+])
+def test_invalid_settings(settings):
+    with pytest.raises(ValueError):
+        ThresholdProfile.compile(settings)
+
+
+def test_equal_settings_share_a_profile():
+    settings = {'budgetPriceMax': 149.5}
+    assert ThresholdProfile.compile(settings) is ThresholdProfile.compile(dict(settings))
+    assert ThresholdProfile.compile(dict(ThresholdProfile.DEFAULTS)) is DEFAULT_THRESHOLDS